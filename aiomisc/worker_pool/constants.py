@@ -1,5 +1,6 @@
 import hashlib
 import logging
+import pickle
 import socket
 from enum import IntEnum
 from struct import Struct
@@ -10,21 +11,47 @@ T = TypeVar("T")
 AddressType = Union[str, Tuple[str, int]]
 
 log = logging.getLogger(__name__)
-Header = Struct("!BI")
+
+# packet type, sequence, payload length, out-of-band buffers count
+Header = Struct("!BIIH")
+# Buffers beyond the header field limit are serialized in-band
+MAX_BUFFERS = 2 ** 16 - 1
+# Request sequence wraps to 1 after this, zero is left for the handshake
+MAX_SEQUENCE = 2 ** 32 - 1
+BufferHeader = Struct("!Q")
+
+# Frames smaller than this will be joined and written at once
+FRAME_COALESCE_SIZE = 64 * 1024
+# Requests larger than this are passed through the shared memory
+SHARED_MEMORY_THRESHOLD = 1024 * 1024
+# Fresh segment is slower than the socket, so the requests which are too
+# large for the spare segments are sent through the socket anyway
+SHARED_MEMORY_MAX_SIZE = 16 * 1024 * 1024
+# Total size of the unused segments kept for reuse by the worker connection
+SHARED_MEMORY_SPARE_SIZE = 32 * 1024 * 1024
+SHARED_MEMORY_PATH = "/dev/shm"
 
 SALT_SIZE = 64
 COOKIE_SIZE = 128
 HASHER = hashlib.sha256
+PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL
+
+# identity, log level, log format, inherited socket file descriptor
+Handshake = Struct("!16sHBi")
+# cookie, port, address length
+AddressHandshake = Struct("!{}sHH".format(COOKIE_SIZE))
 
 
 class PacketTypes(IntEnum):
     REQUEST = 0
     EXCEPTION = 1
     RESULT = 2
-    AUTH_SALT = 50
-    AUTH_DIGEST = 51
+    REGISTER_FUNC = 3
+    REQUEST_SHM = 4
+    UNREGISTER_FUNC = 5
+    AUTH = 50
+    READY = 51
     AUTH_OK = 59
-    IDENTITY = 60
 
 
 INET_AF = socket.AF_INET6
@@ -1,28 +1,35 @@
 import asyncio
 import os
-import pickle
+import secrets
 import socket
 import sys
 import uuid
 import warnings
+from collections import deque
+from contextlib import suppress
 from functools import partial
 from inspect import Traceback
-from itertools import chain
+from itertools import chain, count
 from multiprocessing import AuthenticationError, ProcessError
-from os import chmod, urandom
 from subprocess import Popen, PIPE
-from tempfile import mktemp
-from types import MappingProxyType
+from types import FunctionType, MappingProxyType
 from typing import (
-    Any, Callable, Coroutine, Dict, Mapping, Optional, Set, Tuple, Type,
+    Any, Callable, Coroutine, Deque, Dict, List, Mapping, MutableSet,
+    Optional, Set, Tuple, Type,
 )
+from weakref import WeakKeyDictionary, WeakSet, ref
 
 from aiomisc.log.config import LOG_LEVEL, LOG_FORMAT
+from aiomisc.log.enum import LogFormat
 from aiomisc.thread_pool import threaded
-from aiomisc.utils import bind_socket, cancel_tasks
+from aiomisc.utils import bind_socket
 from aiomisc.worker_pool.constants import (
-    AddressType, INET_AF, COOKIE_SIZE,
-    PacketTypes, Header, log, HASHER, T
+    AddressType, INET_AF, COOKIE_SIZE, BufferHeader, FRAME_COALESCE_SIZE,
+    MAX_SEQUENCE, SHARED_MEMORY_SPARE_SIZE, PacketTypes, Header, log, T
+)
+from aiomisc.worker_pool.protocol import (
+    BufferType, SharedMemory, check_auth_digest, create_shared_memory, loads,
+    pack, pack_handshake, pack_request, release_shared_memory,
 )
 
 
@@ -33,33 +40,68 @@ if sys.version_info < (3, 7):
     )
 
 
+# Popen uses vfork on Linux since Python 3.10, otherwise it forks the whole
+# process, which blocks the calling thread for a while on the large heap.
+SPAWN_IN_THREAD = (
+    sys.version_info < (3, 10) or not sys.platform.startswith("linux")
+)
+
+
+async def _sock_recv_into(
+    loop: asyncio.AbstractEventLoop, sock: socket.socket, view: memoryview,
+) -> int:
+    # loop.sock_recv_into is available since Python 3.7
+    chunk = await loop.sock_recv(sock, len(view))
+    view[:len(chunk)] = chunk
+    return len(chunk)
+
+
+TaskType = Tuple[
+    Callable, Tuple[Any, ...], Dict[str, Any], asyncio.Future, asyncio.Future,
+]
+
+
+def wakeup_waiter(waiters: Deque[asyncio.Future], result: Any) -> bool:
+    """ Pass the result to the first waiter which is not done yet """
+    while waiters:
+        waiter = waiters.popleft()
+        if waiter.done():
+            continue
+        waiter.set_result(result)
+        return True
+    return False
+
+
+def discard_waiter(
+    waiters: Deque[asyncio.Future], waiter: asyncio.Future,
+) -> None:
+    # Waking up might pop the cancelled waiter already
+    with suppress(ValueError):
+        waiters.remove(waiter)
+
+
 class WorkerPool:
-    tasks: asyncio.Queue
-    server: asyncio.AbstractServer
-    address: AddressType
+    address: Optional[AddressType]
     initializer: Optional[Callable[[], Any]]
     initializer_args: Tuple[Any, ...]
     initializer_kwargs: Mapping[str, Any]
 
     if hasattr(socket, "AF_UNIX"):
         def _create_socket(self) -> None:
-            path = mktemp(suffix=".sock", prefix="worker-")
-            self.socket = bind_socket(
-                socket.AF_UNIX,
-                socket.SOCK_STREAM,
-                address=path, port=0,
-            )
-            self.address = path
-            chmod(path, 0o600)
+            # Every worker inherits its end of the connected socket pair,
+            # so neither listening socket nor authorization is required.
+            self.socket: Optional[socket.socket] = None
+            self.address = None
     else:
         def _create_socket(self) -> None:
-            self.socket = bind_socket(
+            sock = bind_socket(
                 INET_AF,
                 socket.SOCK_STREAM,
                 address="localhost",
                 port=0,
             )
-            self.address = self.socket.getsockname()[:2]
+            self.socket = sock
+            self.address = sock.getsockname()[:2]
 
     @staticmethod
     def _kill_process(process: Popen) -> None:
@@ -68,34 +110,63 @@ class WorkerPool:
         log.debug("Terminating worker pool process PID: %s", process.pid)
         process.kill()
 
-    @threaded
-    def __create_process(self, identity: str) -> Popen:
+    def __create_process(
+        self, identity: str
+    ) -> Tuple[Popen, Optional[socket.socket]]:
         if self.__closing:
             raise RuntimeError("Pool closed")
 
-        process = Popen(
-            [sys.executable, "-m", "aiomisc.worker_pool.process"],
-            stdin=PIPE, env=os.environ
+        log_level = (
+            log.getEffectiveLevel() if LOG_LEVEL is None else LOG_LEVEL.get()
+        )
+        log_format = (
+            LogFormat.color if LOG_FORMAT is None else LOG_FORMAT.get()
         )
+
+        parent_socket: Optional[socket.socket] = None
+        child_socket: Optional[socket.socket] = None
+        pass_fds: Tuple[int, ...] = ()
+
+        if self.socket is None:
+            parent_socket, child_socket = socket.socketpair(
+                socket.AF_UNIX, socket.SOCK_STREAM,
+            )
+            pass_fds = (child_socket.fileno(),)
+            handshake = pack_handshake(
+                identity, int(log_level), int(log_format),
+                fileno=child_socket.fileno(),
+            )
+        else:
+            handshake = pack_handshake(
+                identity, int(log_level), int(log_format),
+                address=self.address, cookie=self.__cookie,
+            )
+
+        try:
+            # Every other descriptor is closed in the worker, even ones
+            # which this process inherited itself
+            process = Popen(
+                [sys.executable, "-m", "aiomisc.worker_pool.process"],
+                stdin=PIPE, env=os.environ, pass_fds=pass_fds,
+            )
+        except Exception:
+            if parent_socket is not None:
+                parent_socket.close()
+            raise
+        finally:
+            if child_socket is not None:
+                child_socket.close()
+
         self.__spawning[identity] = process
         log.debug("Spawning new worker pool process PID: %s", process.pid)
 
         assert process.stdin
+        # Worker which died already is reported by the closed socket
+        with suppress(BrokenPipeError):
+            process.stdin.write(handshake)
+            process.stdin.close()
 
-        log_level = (
-            log.getEffectiveLevel() if LOG_LEVEL is None else LOG_LEVEL.get()
-        )
-        log_format = 'color' if LOG_FORMAT is None else LOG_FORMAT.get().value
-
-        process.stdin.write(
-            pickle.dumps((
-                self.address, self.__cookie, identity,
-                log_level, log_format
-            ))
-        )
-        process.stdin.close()
-
-        return process
+        return process, parent_socket
 
     def __init__(
         self, workers: int, max_overflow: int = 0,
@@ -103,24 +174,76 @@ class WorkerPool:
         initializer: Optional[Callable[[], Any]] = None,
         initializer_args: Tuple[Any, ...] = (),
         initializer_kwargs: Mapping[str, Any] = MappingProxyType({}),
+        max_inflight: int = 1,
     ):
+        if max_inflight < 1:
+            raise ValueError("'max_inflight' must be >= 1")
+
         self._create_socket()
-        self.__cookie = urandom(COOKIE_SIZE)
+        # Cookie authorizes the workers connected to the listening socket
+        self.__cookie = (
+            b"" if self.socket is None else secrets.token_bytes(COOKIE_SIZE)
+        )
         self.__loop: Optional[asyncio.AbstractEventLoop] = None
-        self.__futures: Set[asyncio.Future] = set()
+        # Nobody can await an unreferenced future, so there is no need
+        # to reject it on close, it's just garbage collected
+        self.__futures: MutableSet[asyncio.Future] = WeakSet()
         self.__spawning: Dict[str, Popen] = dict()
         self.__task_store: Set[asyncio.Task] = set()
+        self.__task_discard = self.__task_store.discard
         self.__closing = False
         self.__starting: Dict[str, asyncio.Future] = dict()
         self.processes: Set[Popen] = set()
         self.workers = workers
-        self.tasks = asyncio.Queue(maxsize=max_overflow)
+        self.max_overflow = max_overflow
+        # Tasks are passed directly to the idle workers, and only wait
+        # in the pending deque when every worker is busy.
+        self.__idle: Deque[asyncio.Future] = deque()
+        self.__pending: Deque[TaskType] = deque()
+        self.__putters: Deque[asyncio.Future] = deque()
         self.process_poll_time = process_poll_time
         self.initializer = initializer
         self.initializer_args = initializer_args
         self.initializer_kwargs = initializer_kwargs
+        self.max_inflight = max_inflight
+
+    if hasattr(os, "pidfd_open"):
+        async def __wait_pidfd(self, process: Popen) -> None:
+            # The pid of the reaped process might belong to another one.
+            # Processes are reaped only by the loop thread, so it can't be
+            # reaped between the check and pidfd_open.
+            if process.poll() is not None:
+                return None
+
+            try:
+                pidfd = os.pidfd_open(process.pid)
+            except OSError:
+                # Kernel older than 5.3 or the process is already reaped
+                return None
+
+            waiter = self.loop.create_future()
+
+            def on_exit() -> None:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+            try:
+                self.loop.add_reader(pidfd, on_exit)
+                try:
+                    await waiter
+                finally:
+                    self.loop.remove_reader(pidfd)
+            finally:
+                os.close(pidfd)
+    else:
+        async def __wait_pidfd(self, process: Popen) -> None:
+            return None
 
     async def __wait_process(self, process: Popen) -> None:
+        # pidfd becomes readable when the process exits,
+        # so the polling below just reaps the process
+        await self.__wait_pidfd(process)
+
         while process.poll() is None:
             await asyncio.sleep(self.process_poll_time)
 
@@ -131,53 +254,240 @@ class WorkerPool:
         return self.__loop
 
     async def __handle_client(
-        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+        self, sock: socket.socket, identity: Optional[str] = None,
     ) -> None:
-        async def receive() -> Tuple[PacketTypes, Any]:
-            header = await reader.readexactly(Header.size)
-            packet_type, payload_length = Header.unpack(header)
-            payload = await reader.readexactly(payload_length)
-            data = pickle.loads(payload)
-            return PacketTypes(packet_type), data
-
-        async def send(packet_type: PacketTypes, data: Any) -> None:
-            payload = pickle.dumps(data)
-            header = Header.pack(packet_type.value, len(payload))
-            writer.write(header)
-            writer.write(payload)
+        # Bind hot path callables and constants once per connection
+        sock_recv = partial(self.loop.sock_recv, sock)
+        if hasattr(self.loop, "sock_recv_into"):
+            sock_recv_into = partial(self.loop.sock_recv_into, sock)
+        else:
+            sock_recv_into = partial(_sock_recv_into, self.loop, sock)
+        sock_sendall = partial(self.loop.sock_sendall, sock)
+        unpack_header = Header.unpack
+        unpack_buffer_header = BufferHeader.unpack
+        header_size = Header.size
+        buffer_header_size = BufferHeader.size
+        request_type = PacketTypes.REQUEST.value
+        result_type = PacketTypes.RESULT.value
+        exception_type = PacketTypes.EXCEPTION.value
+        register_type = PacketTypes.REGISTER_FUNC.value
+        unregister_type = PacketTypes.UNREGISTER_FUNC.value
+
+        # Functions already known by the worker, requests refer them by id
+        functions: "WeakKeyDictionary[Callable, int]" = WeakKeyDictionary()
+        function_ids = count(1)
+        # Worker forgets the functions garbage collected here, the ids
+        # are sent with the next request
+        function_refs: Dict[int, "ref[Callable]"] = {}
+        released_ids: List[int] = []
+
+        def release_function(func_id: int, _: "ref[Callable]") -> None:
+            function_refs.pop(func_id, None)
+            released_ids.append(func_id)
+
+        # Shared memory segments of the large requests sent by the sequence
+        segments: Dict[int, SharedMemory] = {}
+        # Segments are reused, because the fresh one is slower than the
+        # socket for the page faults on the every write.
+        spare_segments: List[SharedMemory] = []
+
+        def allocate_segment(size: int) -> Optional[SharedMemory]:
+            for index, shm in enumerate(spare_segments):
+                if shm.size >= size:
+                    return spare_segments.pop(index)
+            return create_shared_memory(size)
+
+        def free_segment(shm: SharedMemory) -> None:
+            spare_size = sum(spare.size for spare in spare_segments)
+            if spare_size + shm.size <= SHARED_MEMORY_SPARE_SIZE:
+                spare_segments.append(shm)
+                return None
+            release_shared_memory(shm)
+
+        # Data which was received ahead of the currently read frame part
+        pending = bytearray()
+
+        async def receive_exactly(size: int) -> bytearray:
+            if len(pending) >= size:
+                result = pending[:size]
+                del pending[:size]
+                return result
+
+            result = bytearray(size)
+            view = memoryview(result)
+            offset = len(pending)
+            view[:offset] = pending
+            pending.clear()
+
+            while offset < size:
+                if size - offset < FRAME_COALESCE_SIZE:
+                    # Read ahead, so the following small frame parts
+                    # would be received by the same system call
+                    chunk = await sock_recv(FRAME_COALESCE_SIZE)
+                    received = min(len(chunk), size - offset)
+                    view[offset:offset + received] = chunk[:received]
+                    pending.extend(chunk[received:])
+                else:
+                    received = await sock_recv_into(view[offset:])
 
-        async def step(
-            func: Callable, args: Tuple[Any, ...],
-            kwargs: Dict[str, Any], result_future: asyncio.Future
-        ) -> None:
-            await send(PacketTypes.REQUEST, (func, args, kwargs))
+                if not received:
+                    raise asyncio.IncompleteReadError(
+                        bytes(view[:offset]), size,
+                    )
+
+                offset += received
+
+            return result
+
+        async def receive() -> Tuple[int, int, Any]:
+            header = await receive_exactly(header_size)
+            (
+                packet_type, sequence, payload_length, buffers_count,
+            ) = unpack_header(header)
+            payload = await receive_exactly(payload_length)
 
-            packet_type, result = await receive()
+            buffers = []
+            for _ in range(buffers_count):
+                buffer_header = await receive_exactly(buffer_header_size)
+                buffer_length, = unpack_buffer_header(buffer_header)
+                buffers.append(await receive_exactly(buffer_length))
 
-            if packet_type == PacketTypes.RESULT:
+            return packet_type, sequence, loads(payload, buffers)
+
+        async def send_frame(frame: List[BufferType]) -> None:
+            for part in frame:
+                await sock_sendall(part)
+
+        async def send(packet_type: int, data: Any, sequence: int = 0) -> None:
+            await send_frame(pack(packet_type, data, sequence))
+
+        def set_result(
+            result_future: asyncio.Future, packet_type: int, result: Any,
+        ) -> None:
+            if result_future.done():
+                return None
+
+            if packet_type == result_type:
                 result_future.set_result(result)
                 return None
 
-            if packet_type == PacketTypes.EXCEPTION:
+            if packet_type == exception_type:
                 result_future.set_exception(result)
                 return None
 
             raise ValueError("Unknown packet type")
 
-        async def handler(start_event: asyncio.Event) -> None:
-            log.debug("Starting to handle client")
+        def pack_task(
+            func: Callable, args: Tuple[Any, ...], kwargs: Dict[str, Any],
+            sequence: int,
+        ) -> Tuple[List[BufferType], Optional[SharedMemory]]:
+            frame: List[BufferType] = []
+            # Garbage collector might release more ids meanwhile
+            released = released_ids[:]
+            if released:
+                frame.extend(pack(unregister_type, released))
+
+            # Only plain functions are pickled by reference, so it's safe
+            # to send them once. Any other callable might change its state.
+            target: Any = func
+            register = False
+            if isinstance(func, FunctionType):
+                target = functions.get(func)
+                if target is None:
+                    target = next(function_ids)
+                    register = True
+                    frame.extend(pack(register_type, (target, func)))
+
+            request, shm = pack_request(
+                (target, args, kwargs), sequence, allocate_segment,
+            )
+            frame.extend(request)
+
+            # Nothing is sent when the request can't be packed
+            del released_ids[:len(released)]
+            if register:
+                functions[func] = target
+                function_refs[target] = ref(
+                    func, partial(release_function, target),
+                )
+            return frame, shm
+
+        async def step(
+            func: Callable, args: Tuple[Any, ...],
+            kwargs: Dict[str, Any], result_future: asyncio.Future
+        ) -> None:
+            await send(request_type, (func, args, kwargs))
+            packet_type, _, result = await receive()
+            set_result(result_future, packet_type, result)
+
+        async def send_requests(
+            process: Popen, inflight: Dict[int, asyncio.Future],
+            slots: asyncio.Semaphore,
+        ) -> None:
+            func: Callable
+            args: Tuple[Any, ...]
+            kwargs: Dict[str, Any]
+            result_future: asyncio.Future
+            process_future: asyncio.Future
+
+            max_sequence = MAX_SEQUENCE
+            sequence = 0
+
+            while True:
+                await slots.acquire()
+
+                (
+                    func, args, kwargs, result_future, process_future,
+                ) = await self.__get_task()
+
+                if process_future.done():
+                    slots.release()
+                    continue
+
+                process_future.set_result(process)
+
+                if result_future.done():
+                    slots.release()
+                    continue
+
+                # Sequence must fit the header and differ from the
+                # sequences of the requests still being processed
+                sequence = sequence % max_sequence + 1
+                while sequence in inflight:
+                    sequence = sequence % max_sequence + 1
+
+                try:
+                    frame, shm = pack_task(func, args, kwargs, sequence)
+                except Exception as e:
+                    result_future.set_exception(e)
+                    slots.release()
+                    continue
 
-            packet_type, salt = await receive()
-            assert packet_type == PacketTypes.AUTH_SALT
+                inflight[sequence] = result_future
+                if shm is not None:
+                    segments[sequence] = shm
 
-            packet_type, digest = await receive()
-            assert packet_type == PacketTypes.AUTH_DIGEST
+                await send_frame(frame)
 
-            hasher = HASHER()
-            hasher.update(salt)
-            hasher.update(self.__cookie)
+        async def receive_results(
+            inflight: Dict[int, asyncio.Future], slots: asyncio.Semaphore,
+        ) -> None:
+            while True:
+                packet_type, sequence, result = await receive()
+                result_future = inflight.pop(sequence)
+                slots.release()
+
+                shm = segments.pop(sequence, None)
+                if shm is not None:
+                    free_segment(shm)
+
+                set_result(result_future, packet_type, result)
+
+        async def auth() -> str:
+            packet_type, _, (salt, digest, identity) = await receive()
+            assert packet_type == PacketTypes.AUTH
 
-            if digest != hasher.digest():
+            if not check_auth_digest(digest, salt, self.__cookie):
                 exc = AuthenticationError("Invalid cookie")
                 await send(PacketTypes.EXCEPTION, exc)
                 raise exc
@@ -185,12 +495,61 @@ class WorkerPool:
             await send(PacketTypes.AUTH_OK, True)
 
             log.debug("Client authorized")
+            return identity
+
+        async def ready() -> None:
+            packet_type, _, _ = await receive()
+            assert packet_type == PacketTypes.READY
+
+        async def handler(
+            start_event: asyncio.Event, identity: Optional[str],
+        ) -> None:
+            try:
+                await serve(start_event, identity)
+            finally:
+                if sys.version_info < (3, 8):
+                    # Cancelled sock_recv and sock_sendall keep the
+                    # descriptor in the selector, so the next socket with
+                    # the same descriptor would never be polled. Proactor
+                    # loop has no selector and doesn't support this.
+                    with suppress(NotImplementedError):
+                        self.loop.remove_reader(sock.fileno())
+                        self.loop.remove_writer(sock.fileno())
+                sock.close()
+
+                for shm in chain(segments.values(), spare_segments):
+                    release_shared_memory(shm)
+                segments.clear()
+                spare_segments.clear()
+
+        async def serve(
+            start_event: asyncio.Event, identity: Optional[str],
+        ) -> None:
+            log.debug("Starting to handle client")
+
+            inherited = identity is not None
+            if identity is None:
+                identity = await auth()
 
-            packet_type, identity = await receive()
-            assert packet_type == PacketTypes.IDENTITY
             process = self.__spawning.pop(identity)
             starting: asyncio.Future = self.__starting.pop(identity)
 
+            if inherited:
+                try:
+                    await ready()
+                except (asyncio.IncompleteReadError, OSError):
+                    # Worker died on start, so it must not be respawned
+                    self._kill_process(process)
+                    await self.__wait_process(process)
+
+                    if not starting.done():
+                        starting.set_exception(ProcessError(
+                            "Process {!r} exited with code {!r} "
+                            "on start".format(process, process.returncode),
+                        ))
+                    start_event.set()
+                    return None
+
             if self.initializer is not None:
                 initializer_done = self.__create_future()
 
@@ -214,54 +573,54 @@ class WorkerPool:
                 starting.set_result(None)
                 start_event.set()
 
-            while True:
-                func: Callable
-                args: Tuple[Any, ...]
-                kwargs: Dict[str, Any]
-                result_future: asyncio.Future
-                process_future: asyncio.Future
-
-                (
-                    func, args, kwargs, result_future, process_future,
-                ) = await self.tasks.get()
-
-                try:
-                    if process_future.done():
-                        continue
+            # Requests are sent while the previous results are awaited,
+            # up to max_inflight requests per worker.
+            inflight: Dict[int, asyncio.Future] = {}
+            slots = asyncio.Semaphore(self.max_inflight)
+            sender = self.loop.create_task(
+                send_requests(process, inflight, slots),
+            )
+            receiver = self.loop.create_task(receive_results(inflight, slots))
 
-                    process_future.set_result(process)
+            try:
+                await asyncio.wait(
+                    (sender, receiver), return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                sender.cancel()
+                receiver.cancel()
+                await asyncio.wait((sender, receiver))
+
+            exc = next(
+                task.exception() for task in (receiver, sender)
+                if not task.cancelled()
+            )
+            # Both loops are infinite and stop only by exception
+            assert exc is not None
 
-                    if result_future.done():
-                        continue
+            if isinstance(exc, (asyncio.IncompleteReadError, OSError)):
+                await self.__wait_process(process)
 
-                    await step(func, args, kwargs, result_future)
-                except asyncio.IncompleteReadError:
-                    await self.__wait_process(process)
-
-                    result_future.set_exception(
-                        ProcessError(
-                            "Process {!r} exited with code {!r}".format(
-                                process, process.returncode,
-                            ),
-                        ),
-                    )
-                    break
-                except Exception as e:
-                    if not result_future.done():
-                        self.loop.call_soon(result_future.set_exception, e)
+                exc = ProcessError(
+                    "Process {!r} exited with code {!r}".format(
+                        process, process.returncode,
+                    ),
+                )
 
-                    if not writer.is_closing():
-                        self.loop.call_soon(writer.close)
+            for result_future in inflight.values():
+                if not result_future.done():
+                    result_future.set_exception(exc)
 
-                    raise
+            if not isinstance(exc, ProcessError):
+                raise exc
 
         start_event = asyncio.Event()
-        task = self.loop.create_task(handler(start_event))
+        task = self.loop.create_task(handler(start_event, identity))
         await start_event.wait()
         self.__task_add(task)
 
     def __task_add(self, task: asyncio.Task) -> None:
-        task.add_done_callback(self.__task_store.remove)
+        task.add_done_callback(self.__task_discard)
         self.__task_store.add(task)
 
     def __task(self, coroutine: Coroutine) -> asyncio.Task:
@@ -269,11 +628,17 @@ class WorkerPool:
         self.__task_add(task)
         return task
 
+    async def __accept(self, sock: socket.socket) -> None:
+        sock.listen()
+
+        while True:
+            client, _ = await self.loop.sock_accept(sock)
+            client.setblocking(False)
+            self.__task(self.__handle_client(client))
+
     async def start(self) -> None:
-        self.server = await asyncio.start_server(
-            self.__handle_client,
-            sock=self.socket,
-        )
+        if self.socket is not None:
+            self.__task(self.__accept(self.socket))
 
         tasks = []
 
@@ -288,7 +653,10 @@ class WorkerPool:
             if self.__closing:
                 return None
 
-            await self.__spawn_process()
+            try:
+                await self.__spawn_process()
+            except ProcessError:
+                log.exception("Failed to respawn worker pool process")
             self.processes.remove(process)
 
         self.__task(respawn())
@@ -299,7 +667,15 @@ class WorkerPool:
         identity = uuid.uuid4().hex
         start_future = self.__create_future()
         self.__starting[identity] = start_future
-        process = await self.__create_process(identity)
+        if SPAWN_IN_THREAD:
+            process, sock = await threaded(self.__create_process)(identity)
+        else:
+            process, sock = self.__create_process(identity)
+
+        if sock is not None:
+            sock.setblocking(False)
+            self.__task(self.__handle_client(sock, identity))
+
         await start_future
         self.processes.add(process)
 
@@ -309,7 +685,6 @@ class WorkerPool:
     def __create_future(self) -> asyncio.Future:
         future = self.loop.create_future()
         self.__futures.add(future)
-        future.add_done_callback(self.__futures.remove)
         return future
 
     def __reject_futures(self) -> None:
@@ -324,13 +699,69 @@ class WorkerPool:
 
         self.__closing = True
 
-        await cancel_tasks(
-            chain(tuple(self.__task_store), tuple(self.__futures))
+        # Single snapshot of both sets, already done ones are not touched
+        pending: List[asyncio.Future] = [
+            task for task in self.__task_store if not task.done()
+        ]
+        pending.extend(
+            future for future in self.__futures if not future.done()
         )
 
+        for future in pending:
+            future.cancel()
+
+        await asyncio.gather(*pending, return_exceptions=True)
+
         while self.processes:
             self._kill_process(self.processes.pop())
 
+    def __dispatch_task(self, task: TaskType) -> None:
+        if not wakeup_waiter(self.__idle, task):
+            self.__pending.append(task)
+
+    def __wakeup_putter(self) -> None:
+        wakeup_waiter(self.__putters, None)
+
+    async def __get_task(self) -> TaskType:
+        if self.__pending:
+            task = self.__pending.popleft()
+            self.__wakeup_putter()
+            return task
+
+        waiter = self.loop.create_future()
+        self.__idle.append(waiter)
+        # Idle worker might take the task of the blocked producer
+        self.__wakeup_putter()
+
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if not waiter.done() or waiter.cancelled():
+                discard_waiter(self.__idle, waiter)
+            else:
+                # Task was passed to the worker which is cancelled now
+                self.__dispatch_task(waiter.result())
+            raise
+
+    async def __put_task(self, task: TaskType) -> None:
+        while (
+            self.max_overflow > 0 and not self.__idle and
+            len(self.__pending) >= self.max_overflow
+        ):
+            putter = self.loop.create_future()
+            self.__putters.append(putter)
+
+            try:
+                await putter
+            except asyncio.CancelledError:
+                if not putter.done() or putter.cancelled():
+                    discard_waiter(self.__putters, putter)
+                else:
+                    self.__wakeup_putter()
+                raise
+
+        self.__dispatch_task(task)
+
     async def create_task(
         self, func: Callable[..., T],
         *args: Any, **kwargs: Any
@@ -338,7 +769,7 @@ class WorkerPool:
         result_future = self.__create_future()
         process_future = self.__create_future()
 
-        await self.tasks.put((
+        await self.__put_task((
             func, args, kwargs, result_future, process_future,
         ))
 
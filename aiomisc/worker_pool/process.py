@@ -1,71 +1,130 @@
 import logging
-import pickle
 import socket
 import sys
 from os import urandom
-from typing import Tuple, Union, Any
+from io import BufferedReader
+from typing import Any, Callable, Dict, Optional, Tuple, Union
 
 from aiomisc.worker_pool.constants import (
-    INET_AF, PacketTypes, Header, HASHER, SALT_SIZE
+    INET_AF, PacketTypes, Header, BufferHeader, SALT_SIZE,
+    FRAME_COALESCE_SIZE,
+)
+from aiomisc.worker_pool.protocol import (
+    auth_digest, load_shared, loads, pack, unpack_handshake,
 )
 from aiomisc.log import basic_config
+from aiomisc.log.enum import LogFormat
 
 
 def main() -> None:
-    address: Union[str, Tuple[str, int]]
+    address: Optional[Union[str, Tuple[str, int]]]
     cookie: bytes
     identity: str
 
     (
-        address, cookie, identity, log_level, log_format
-    ) = pickle.load(sys.stdin.buffer)
-
-    basic_config(level=log_level, log_format=log_format)
-
-    family = (
-        socket.AF_UNIX if isinstance(address, str) else INET_AF
-    )
-
-    with socket.socket(family, socket.SOCK_STREAM) as sock:
-        logging.debug("Connecting...")
-        sock.connect(address)
-
-        def send(packet_type: PacketTypes, data: Any) -> None:
-            payload = pickle.dumps(data)
-            sock.send(Header.pack(packet_type.value, len(payload)))
-            sock.send(payload)
-
-        def receive() -> Tuple[PacketTypes, Any]:
-            header = sock.recv(Header.size)
-
-            if not header:
-                raise ValueError("No data")
-
-            packet_type, payload_length = Header.unpack(header)
-            payload = sock.recv(payload_length)
-            return PacketTypes(packet_type), pickle.loads(payload)
-
-        def auth(cookie: bytes) -> None:
-            hasher = HASHER()
+        identity, log_level, log_format, fileno, address, cookie,
+    ) = unpack_handshake(sys.stdin.buffer)
+
+    basic_config(level=log_level, log_format=LogFormat(log_format))
+
+    if address is None:
+        # Connected socket was inherited from the parent process
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, fileno=fileno)
+    else:
+        family = (
+            socket.AF_UNIX if isinstance(address, str) else INET_AF
+        )
+        sock = socket.socket(family, socket.SOCK_STREAM)
+
+    with sock:
+        # Buffered reader receives header and small payload by one recv call
+        rfile = BufferedReader(
+            socket.SocketIO(sock, "rb"), FRAME_COALESCE_SIZE,
+        )
+
+        def send(
+            packet_type: PacketTypes, data: Any, sequence: int = 0,
+        ) -> None:
+            for part in pack(packet_type, data, sequence):
+                sock.sendall(part)
+
+        def receive_into(buffer: bytearray) -> bytearray:
+            view = memoryview(buffer)
+
+            while view:
+                received = rfile.readinto(view)
+                if not received:
+                    raise ValueError("No data")
+                view = view[received:]
+
+            return buffer
+
+        # Headers are received into the buffers allocated once
+        header_buffer = bytearray(Header.size)
+        buffer_header_buffer = bytearray(BufferHeader.size)
+
+        def receive() -> Tuple[PacketTypes, int, Any]:
+            (
+                packet_type, sequence, payload_length, buffers_count,
+            ) = Header.unpack(receive_into(header_buffer))
+            payload = receive_into(bytearray(payload_length))
+
+            buffers = []
+            for _ in range(buffers_count):
+                buffer_length, = BufferHeader.unpack(
+                    receive_into(buffer_header_buffer),
+                )
+                buffers.append(receive_into(bytearray(buffer_length)))
+
+            return PacketTypes(packet_type), sequence, loads(payload, buffers)
+
+        def auth(cookie: bytes, identity: str) -> None:
             salt = urandom(SALT_SIZE)
-            send(PacketTypes.AUTH_SALT, salt)
-            hasher.update(salt)
-            hasher.update(cookie)
-            send(PacketTypes.AUTH_DIGEST, hasher.digest())
+            send(
+                PacketTypes.AUTH,
+                (salt, auth_digest(salt, cookie), identity),
+            )
 
-            packet_type, value = receive()
+            packet_type, _, value = receive()
             if packet_type == PacketTypes.AUTH_OK:
                 return value
 
             raise RuntimeError(PacketTypes(packet_type), value)
 
+        # Functions registered by the parent process
+        functions: Dict[int, Callable] = {}
+
         def step() -> bool:
             try:
-                packet_type, (func, args, kwargs) = receive()
+                packet_type, sequence, payload = receive()
             except ValueError:
                 return True
 
-            if packet_type == packet_type.REQUEST:
+            if packet_type == PacketTypes.REGISTER_FUNC:
+                func_id, func = payload
+                functions[func_id] = func
+                return False
+
+            if packet_type == PacketTypes.UNREGISTER_FUNC:
+                for func_id in payload:
+                    functions.pop(func_id, None)
+                return False
+
+            if packet_type == PacketTypes.REQUEST_SHM:
+                try:
+                    payload = load_shared(*payload)
+                except Exception as e:
+                    logging.exception("Failed to load shared request")
+                    send(PacketTypes.EXCEPTION, e, sequence)
+                    return False
+
+                packet_type = PacketTypes.REQUEST
+
+            if packet_type == PacketTypes.REQUEST:
+                func, args, kwargs = payload
+                if isinstance(func, int):
+                    func = functions[func]
+
                 response_type = PacketTypes.RESULT
                 try:
                     result = func(*args, **kwargs)
@@ -74,14 +133,20 @@ def main() -> None:
                     result = e
                     logging.exception("Exception when processing request")
 
-                send(response_type, result)
+                send(response_type, result, sequence)
             return False
 
-        logging.debug("Starting authorization")
-        auth(cookie)
-        del cookie
+        if address is not None:
+            logging.debug("Connecting...")
+            sock.connect(address)
+
+            logging.debug("Starting authorization")
+            auth(cookie, identity)
+            del cookie
+        else:
+            # Parent doesn't count the worker as started until this
+            send(PacketTypes.READY, None)
 
-        send(PacketTypes.IDENTITY, identity)
         logging.debug("Worker ready")
         try:
             while not step():
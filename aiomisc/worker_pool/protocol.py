@@ -0,0 +1,315 @@
+import hmac
+import mmap
+import os
+import pickle
+import sys
+from contextlib import contextmanager
+from typing import (
+    Any, BinaryIO, Callable, Iterator, List, Optional, Sequence, Tuple,
+    Union,
+)
+
+from aiomisc.worker_pool.constants import (
+    AddressHandshake, AddressType, BufferHeader, FRAME_COALESCE_SIZE, HASHER,
+    Handshake, Header, MAX_BUFFERS, PICKLE_PROTOCOL, SHARED_MEMORY_MAX_SIZE,
+    SHARED_MEMORY_PATH, SHARED_MEMORY_THRESHOLD, PacketTypes, log,
+)
+
+try:
+    from multiprocessing.shared_memory import SharedMemory as SharedMemory
+except ImportError:
+    # Python < 3.8 or the platform without shared memory support
+    SharedMemory = None  # type: ignore
+
+try:
+    import _posixshmem  # type: ignore
+except ImportError:
+    _posixshmem = None
+
+
+BufferType = Union[bytes, bytearray, memoryview]
+
+
+if PICKLE_PROTOCOL >= 5:
+    def dumps(data: Any) -> Tuple[bytes, List[memoryview]]:
+        """ Pickle data, large contiguous buffers are returned out-of-band """
+        buffers: List[memoryview] = []
+
+        def buffer_callback(buffer: pickle.PickleBuffer) -> bool:
+            if len(buffers) >= MAX_BUFFERS:
+                return True
+
+            try:
+                buffers.append(buffer.raw())
+            except BufferError:
+                # Non contiguous buffers should be serialized in-band
+                return True
+            return False
+
+        payload = pickle.dumps(
+            data, protocol=PICKLE_PROTOCOL, buffer_callback=buffer_callback,
+        )
+        return payload, buffers
+
+    def loads(payload: BufferType, buffers: Sequence[BufferType]) -> Any:
+        return pickle.loads(payload, buffers=buffers)
+else:
+    def dumps(data: Any) -> Tuple[bytes, List[memoryview]]:
+        return pickle.dumps(data, protocol=PICKLE_PROTOCOL), []
+
+    def loads(payload: BufferType, buffers: Sequence[BufferType]) -> Any:
+        return pickle.loads(payload)
+
+
+def pack(packet_type: int, data: Any, sequence: int = 0) -> List[BufferType]:
+    """
+    Serialize data to the list of frame parts. Frame contains the header,
+    the pickle payload and every out-of-band buffer with its length prefix.
+    The ``sequence`` matches the response with the request.
+    Small frames are built in the single buffer, so they might be written
+    with one system call and without allocating the headers separately.
+    """
+    payload, buffers = dumps(data)
+    return pack_frame(packet_type, sequence, payload, buffers)
+
+
+def pack_frame(
+    packet_type: int, sequence: int, payload: bytes,
+    buffers: Sequence[memoryview],
+) -> List[BufferType]:
+    size = Header.size + len(payload)
+
+    for buffer in buffers:
+        size += BufferHeader.size + buffer.nbytes
+
+    if size >= FRAME_COALESCE_SIZE:
+        parts: List[BufferType] = [
+            Header.pack(
+                packet_type, sequence, len(payload), len(buffers),
+            ),
+            payload,
+        ]
+
+        for buffer in buffers:
+            parts.append(BufferHeader.pack(buffer.nbytes))
+            parts.append(buffer)
+
+        return parts
+
+    frame = bytearray(size)
+    Header.pack_into(
+        frame, 0, packet_type, sequence, len(payload), len(buffers),
+    )
+    offset = Header.size + len(payload)
+    frame[Header.size:offset] = payload
+
+    for buffer in buffers:
+        BufferHeader.pack_into(frame, offset, buffer.nbytes)
+        offset += BufferHeader.size
+        frame[offset:offset + buffer.nbytes] = buffer
+        offset += buffer.nbytes
+
+    return [frame]
+
+
+def create_shared_memory(size: int) -> Optional["SharedMemory"]:
+    # Size is rounded up, so the segment might be reused by the similar
+    # requests. Untouched pages of the segment take no memory.
+    size += -size % SHARED_MEMORY_THRESHOLD
+    try:
+        return SharedMemory(create=True, size=size)
+    except OSError:
+        log.debug("Failed to create shared memory segment", exc_info=True)
+        return None
+
+
+if hasattr(os, "statvfs"):
+    def shared_memory_fits(size: int) -> bool:
+        # Segment is sparse, so writing it on the full tmpfs kills
+        # the process by SIGBUS instead of raising an error
+        try:
+            stat = os.statvfs(SHARED_MEMORY_PATH)
+        except OSError:
+            # Shared memory is not mounted there, e.g. on macOS
+            return True
+        return stat.f_bavail * stat.f_frsize >= size
+else:
+    def shared_memory_fits(size: int) -> bool:
+        return True
+
+
+def pack_request(
+    data: Any, sequence: int = 0,
+    allocate: Callable[
+        [int], Optional["SharedMemory"],
+    ] = create_shared_memory,
+) -> Tuple[List[BufferType], Optional["SharedMemory"]]:
+    """
+    Serialize the request like ``pack`` does. Large requests are copied
+    to the shared memory segment returned by ``allocate`` instead, and
+    the ``REQUEST_SHM`` frame contains just the segment name and the parts
+    lengths. The caller owns the returned segment, and it might be reused
+    after the response is received. Request is sent through the socket
+    when there is no segment for it.
+    """
+    payload, buffers = dumps(data)
+    size = len(payload) + sum(buffer.nbytes for buffer in buffers)
+
+    shm = None
+    if (
+        SharedMemory is not None and
+        SHARED_MEMORY_THRESHOLD <= size <= SHARED_MEMORY_MAX_SIZE and
+        shared_memory_fits(size)
+    ):
+        shm = allocate(size)
+
+    if shm is None:
+        frame = pack_frame(PacketTypes.REQUEST, sequence, payload, buffers)
+        return frame, None
+
+    try:
+        view = shm.buf
+        assert view is not None
+        view[:len(payload)] = payload
+        offset = len(payload)
+
+        for buffer in buffers:
+            view[offset:offset + buffer.nbytes] = buffer
+            offset += buffer.nbytes
+
+        frame = pack(
+            PacketTypes.REQUEST_SHM, (
+                shm.name, len(payload),
+                [buffer.nbytes for buffer in buffers],
+            ), sequence,
+        )
+    except Exception:
+        release_shared_memory(shm)
+        raise
+
+    return frame, shm
+
+
+def release_shared_memory(shm: "SharedMemory") -> None:
+    shm.close()
+    shm.unlink()
+
+
+if (
+    sys.version_info < (3, 13) and
+    getattr(_posixshmem, "shm_open", None) is not None
+):
+    @contextmanager
+    def attach_shared_memory(name: str) -> Iterator[memoryview]:
+        # SharedMemory registers the attached segment in the resource
+        # tracker, which is the separate process for the worker, and
+        # unlinks the segment owned by the parent when mmap fails.
+        # POSIX name starts with the slash stripped from SharedMemory.name
+        fd = _posixshmem.shm_open("/" + name, os.O_RDONLY, mode=0o600)
+        try:
+            mapping = mmap.mmap(
+                fd, os.fstat(fd).st_size, prot=mmap.PROT_READ,
+            )
+        finally:
+            os.close(fd)
+
+        with mapping:
+            view = memoryview(mapping)
+            try:
+                yield view
+            finally:
+                view.release()
+else:
+    # Segment is owned by the parent, so it's not tracked by the worker
+    # since Python 3.13. There is no resource tracker on Windows.
+    SHARED_MEMORY_ATTACH_KWARGS = (
+        {"track": False} if sys.version_info >= (3, 13) else {}
+    )
+
+    @contextmanager
+    def attach_shared_memory(name: str) -> Iterator[memoryview]:
+        shm = SharedMemory(name, **SHARED_MEMORY_ATTACH_KWARGS)
+        try:
+            assert shm.buf is not None
+            yield shm.buf
+        finally:
+            shm.close()
+
+
+def load_shared(
+    name: str, payload_length: int, buffer_lengths: Sequence[int],
+) -> Any:
+    """
+    Deserialize the request from the shared memory segment. Buffers are
+    copied out, so the segment is closed before the request is processed.
+    """
+    with attach_shared_memory(name) as view:
+        offset = payload_length
+        buffers = []
+
+        for length in buffer_lengths:
+            buffers.append(bytearray(view[offset:offset + length]))
+            offset += length
+
+        payload = view[:payload_length]
+        try:
+            return loads(payload, buffers)
+        finally:
+            payload.release()
+
+
+def pack_handshake(
+    identity: str, log_level: int, log_format: int, *,
+    fileno: int = -1, address: Optional[AddressType] = None,
+    cookie: bytes = b""
+) -> bytes:
+    """
+    Pack the worker startup parameters. The worker either inherits the
+    connected socket with passed ``fileno`` or it connects to the ``address``
+    and authorizes itself by the ``cookie``.
+    """
+    handshake = Handshake.pack(
+        bytes.fromhex(identity), log_level, log_format, fileno,
+    )
+
+    if address is None:
+        return handshake
+
+    if isinstance(address, str):
+        host, port = address, 0
+    else:
+        host, port = address
+
+    address_bytes = host.encode()
+
+    return handshake + AddressHandshake.pack(
+        cookie, port, len(address_bytes),
+    ) + address_bytes
+
+
+def unpack_handshake(
+    fp: BinaryIO
+) -> Tuple[str, int, int, int, Optional[AddressType], bytes]:
+    identity, log_level, log_format, fileno = Handshake.unpack(
+        fp.read(Handshake.size),
+    )
+
+    if fileno >= 0:
+        return identity.hex(), log_level, log_format, fileno, None, b""
+
+    cookie, port, address_length = AddressHandshake.unpack(
+        fp.read(AddressHandshake.size),
+    )
+
+    host = fp.read(address_length).decode()
+    address: AddressType = (host, port) if port else host
+    return identity.hex(), log_level, log_format, fileno, address, cookie
+
+
+def auth_digest(salt: bytes, cookie: bytes) -> bytes:
+    """ HMAC of the salt keyed by the pool cookie """
+    return hmac.new(cookie, salt, HASHER).digest()
+
+
+def check_auth_digest(digest: bytes, salt: bytes, cookie: bytes) -> bool:
+    return hmac.compare_digest(digest, auth_digest(salt, cookie))
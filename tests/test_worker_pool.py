@@ -1,13 +1,20 @@
 import asyncio
+import gc
 import operator
+import pickle
 import sys
+from collections import deque
 from multiprocessing.context import ProcessError
-from os import getpid
+from os import getpid, urandom
 from time import sleep
+from types import FunctionType
 
 import pytest
 
 from aiomisc import WorkerPool
+from aiomisc.worker_pool import protocol
+from aiomisc.worker_pool.constants import PacketTypes
+from aiomisc.worker_pool.pool import discard_waiter, wakeup_waiter
 
 
 @pytest.fixture
@@ -27,6 +34,274 @@ async def test_success(worker_pool):
     assert sorted(results) == [i * i for i in range(worker_pool.workers * 2)]
 
 
+async def test_large_payload(worker_pool):
+    payload = bytearray(urandom(1024 * 1024))
+    result = await worker_pool.create_task(bytearray, payload)
+
+    assert isinstance(result, bytearray)
+    assert result == payload
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 8), reason="pickle protocol 5 is required",
+)
+@pytest.mark.parametrize("size", [16, 1024 * 1024])
+async def test_out_of_band_buffers(worker_pool, size):
+    payload = bytearray(urandom(size))
+
+    result = await worker_pool.create_task(
+        bytes, pickle.PickleBuffer(payload),
+    )
+    assert result == payload
+
+    result = await worker_pool.create_task(pickle.PickleBuffer, payload)
+    assert isinstance(result, bytearray)
+    assert result == payload
+
+
+def pickle_buffers(count):
+    return [pickle.PickleBuffer(bytearray(b"x")) for _ in range(count)]
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 8), reason="pickle protocol 5 is required",
+)
+async def test_out_of_band_buffers_count(worker_pool):
+    # Buffers count exceeds the header field
+    count = 2 ** 16 + 1
+
+    payload = pickle_buffers(count)
+    assert await worker_pool.create_task(len, payload) == count
+
+    result = await worker_pool.create_task(pickle_buffers, count)
+    assert len(result) == count
+    assert all(bytes(buffer) == b"x" for buffer in result)
+
+
+async def test_large_request(worker_pool):
+    text = "x" * 2 * 1024 * 1024
+    payload = bytearray(urandom(1024 * 1024))
+
+    result = await worker_pool.create_task(
+        operator.concat, text, text,
+    )
+    assert result == text * 2
+
+    results = await asyncio.gather(*[
+        worker_pool.create_task(len, payload)
+        for _ in range(worker_pool.workers * 2)
+    ])
+    assert results == [len(payload)] * worker_pool.workers * 2
+
+
+async def test_large_request_fallback(worker_pool, monkeypatch):
+    def shared_memory(*args, **kwargs):
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(
+        "aiomisc.worker_pool.protocol.SharedMemory", shared_memory,
+    )
+
+    payload = bytearray(urandom(2 * 1024 * 1024))
+    assert await worker_pool.create_task(bytes, payload) == payload
+
+
+async def test_large_request_attach_failure(loop, monkeypatch):
+    shared_memory = pytest.importorskip("multiprocessing.shared_memory")
+
+    class MissingSharedMemory(shared_memory.SharedMemory):
+        @property
+        def name(self):
+            return "aiomisc-missing-segment"
+
+    def create_shared_memory(size):
+        return MissingSharedMemory(create=True, size=size)
+
+    monkeypatch.setattr(
+        "aiomisc.worker_pool.pool.create_shared_memory",
+        create_shared_memory,
+    )
+
+    async with WorkerPool(1) as pool:
+        pid = await pool.create_task(getpid)
+
+        with pytest.raises(FileNotFoundError):
+            await pool.create_task(len, bytearray(2 * 1024 * 1024))
+
+        assert await pool.create_task(getpid) == pid
+
+
+def square(value):
+    return value * value
+
+
+def negate(value):
+    return -value
+
+
+async def test_registered_functions(worker_pool):
+    results = await asyncio.gather(*[
+        worker_pool.create_task(square if i % 2 else negate, i)
+        for i in range(worker_pool.workers * 4)
+    ])
+
+    assert results == [
+        i * i if i % 2 else -i for i in range(worker_pool.workers * 4)
+    ]
+
+
+# Replaced by the new function object, so the previous one is released
+dynamic_square = square
+
+
+def redefine_square():
+    global dynamic_square
+    dynamic_square = FunctionType(square.__code__, globals())
+    dynamic_square.__qualname__ = "dynamic_square"
+    return dynamic_square
+
+
+async def test_unregister_functions(loop, monkeypatch):
+    registered = []
+    unregistered = []
+
+    def pack(packet_type, data, sequence=0):
+        # Functions themselves must not be kept here
+        if packet_type == PacketTypes.REGISTER_FUNC:
+            registered.append(data[0])
+        elif packet_type == PacketTypes.UNREGISTER_FUNC:
+            unregistered.extend(data)
+        return protocol.pack(packet_type, data, sequence)
+
+    monkeypatch.setattr("aiomisc.worker_pool.pool.pack", pack)
+
+    async with WorkerPool(1) as pool:
+        for i in range(4):
+            func = redefine_square()
+            assert await pool.create_task(func, i) == i * i
+            del func
+            gc.collect()
+
+    assert len(registered) == 4
+    # Last function is released when there are no more requests
+    assert unregistered == registered[:-1]
+
+
+async def test_max_inflight(loop):
+    async with WorkerPool(2, max_inflight=4) as pool:
+        results = await asyncio.gather(*[
+            pool.create_task(operator.mul, i, i) for i in range(32)
+        ])
+
+        assert results == [i * i for i in range(32)]
+
+        exceptions = await asyncio.gather(*[
+            pool.create_task(operator.truediv, i, 0) for i in range(8)
+        ], return_exceptions=True)
+
+        for exc in exceptions:
+            assert isinstance(exc, ZeroDivisionError)
+
+        exceptions = await asyncio.gather(
+            *[pool.create_task(exit, 1) for _ in range(8)],
+            return_exceptions=True
+        )
+
+        for exc in exceptions:
+            assert isinstance(exc, ProcessError)
+
+        assert await pool.create_task(operator.mul, 2, 2) == 4
+
+
+@pytest.mark.parametrize("max_inflight", [0, -1])
+def test_max_inflight_invalid(max_inflight):
+    with pytest.raises(ValueError):
+        WorkerPool(1, max_inflight=max_inflight)
+
+
+async def test_sequence_wrap(loop, monkeypatch):
+    monkeypatch.setattr("aiomisc.worker_pool.pool.MAX_SEQUENCE", 3)
+
+    async with WorkerPool(1, max_inflight=2) as pool:
+        for i in range(8):
+            assert await pool.create_task(operator.mul, i, i) == i * i
+
+        results = await asyncio.gather(*[
+            pool.create_task(operator.mul, i, i) for i in range(16)
+        ])
+
+    assert results == [i * i for i in range(16)]
+
+
+async def test_max_overflow(loop):
+    async with WorkerPool(2, max_overflow=1) as pool:
+        results = await asyncio.gather(*[
+            pool.create_task(operator.mul, i, i) for i in range(16)
+        ])
+
+    assert results == [i * i for i in range(16)]
+
+
+async def test_max_overflow_cancel_producer(loop):
+    async with WorkerPool(1, max_overflow=1) as pool:
+        busy = loop.create_task(pool.create_task(sleep, 0.5))
+        await asyncio.sleep(0.1)
+
+        queued = loop.create_task(pool.create_task(operator.mul, 2, 2))
+        blocked = loop.create_task(pool.create_task(operator.mul, 3, 3))
+        await asyncio.sleep(0.1)
+
+        blocked.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await blocked
+
+        await busy
+        assert await queued == 4
+        assert await pool.create_task(operator.mul, 4, 4) == 16
+
+
+async def test_wakeup_waiter(loop):
+    cancelled = loop.create_future()
+    cancelled.cancel()
+    waiter = loop.create_future()
+    waiters = deque([cancelled, waiter])
+
+    assert wakeup_waiter(waiters, 1)
+    assert waiter.result() == 1
+    assert not waiters
+    assert not wakeup_waiter(waiters, 2)
+
+    # Cancelled waiter might be popped before its owner is resumed
+    discard_waiter(waiters, cancelled)
+
+    waiters.append(cancelled)
+    discard_waiter(waiters, cancelled)
+    assert not waiters
+
+
+async def test_idle_worker_exit(loop):
+    async with WorkerPool(2) as pool:
+        for process in tuple(pool.processes):
+            process.kill()
+
+        # Tasks are dispatched while waiters of the dead workers are
+        # being cancelled
+        results = await asyncio.gather(*[
+            pool.create_task(operator.mul, i, i) for i in range(8)
+        ], return_exceptions=True)
+
+        for i, result in enumerate(results):
+            if isinstance(result, ProcessError):
+                continue
+            assert result == i * i
+
+        results = await asyncio.gather(*[
+            pool.create_task(operator.mul, i, i) for i in range(8)
+        ])
+        assert results == [i * i for i in range(8)]
+
+
 async def test_incomplete_task_kill(worker_pool):
     pids_start = set(await asyncio.gather(
         *[worker_pool.create_task(getpid)
@@ -124,6 +399,42 @@ async def test_initializer(worker_pool):
     assert kwargs is None
 
 
+async def test_sequential_pools(loop):
+    # Sockets of the closed pool must not break the next one
+    for _ in range(3):
+        async with WorkerPool(1, initializer=initializer) as pool:
+            assert await pool.create_task(operator.mul, 2, 2) == 4
+
+
+async def test_parallel_start(loop):
+    delay = 1
+    pool = WorkerPool(4, initializer=sleep, initializer_args=(delay,))
+
+    started_at = loop.time()
+    async with pool:
+        elapsed = loop.time() - started_at
+
+    assert delay <= elapsed < delay * pool.workers
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="POSIX shell required")
+async def test_start_failure(loop, monkeypatch, tmp_path):
+    executable = tmp_path / "python"
+    executable.write_text("#!/bin/sh\ncat > /dev/null\nexit 1\n")
+    executable.chmod(0o755)
+    monkeypatch.setattr(sys, "executable", str(executable))
+
+    pool = WorkerPool(2)
+
+    try:
+        with pytest.raises(ProcessError):
+            await pool.start()
+    finally:
+        await pool.close()
+
+    assert not pool.processes
+
+
 def bad_initializer():
     return 1 / 0
 